@@ -24,20 +24,20 @@ Testing:
 
     - router connection: basic device connection test
 
-    - `ping` command: basic device ping test; logs ping result.
+    - `ping` command: basic device ping test; pings every destination from
+                      both devices concurrently and logs each ping result.
 
     - interface count verification
 
-        - execute `show version` command: basic command execution and data
-                                          parsing; extract ethernet and serial
-                                          interface counts; logs interface
-                                          counts.
+        - execute `show version` and `show ip interface brief` commands in a
+          single batched call.
 
-        - execute `show ip interface brief` command: basic command execution and
-                                                     data parsing; extract all
-                                                     ethernet and serial
-                                                     interfaces; logs number of
-                                                     interface counts.
+        - parse `show version` output: extract ethernet and serial interface
+                                       counts; logs interface counts.
+
+        - parse `show ip interface brief` output: extract all ethernet and
+                                                  serial interfaces; logs
+                                                  number of interface counts.
 
         - verify ethernet and serial interface counts from above commands.
 
@@ -66,15 +66,63 @@ __date__= 'Nov 15, 2017'
 #
 import re
 import logging
+from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
 
 from ats import aetest
-from ats.log.utils import banner
 
 #
 # create a logger for this testscript
 #
 logger = logging.getLogger(__name__)
 
+def _info(msg_fn):
+    '''
+    log msg_fn() as an info banner, only building the message and banner when
+    the logger would actually emit it
+    '''
+    if logger.isEnabledFor(logging.INFO):
+        # local imports: only resolved once a banner is actually logged
+        from ats.log.utils import banner
+
+        logger.info(banner(msg_fn()))
+
+#
+# precompiled regular expressions used to parse command outputs
+#
+_PING_RE = re.compile(r'Success rate is (\d+) percent')
+_INTF_RE = re.compile(r'\r\n(GigabitEthernet|Serial)\d+/\d+\s+')
+
+def _link_index(testbed):
+    '''
+    return {frozenset of two device names: set of links between them}
+
+    The index is built from testbed.links on first use and cached on the
+    testbed, so later lookups don't rescan every link.
+    '''
+    try:
+        return testbed._link_index
+    except AttributeError:
+        pass
+
+    index = {}
+    for link in testbed.links:
+        names = {intf.device.name for intf in link.interfaces}
+        for pair in combinations(names, 2):
+            index.setdefault(frozenset(pair), set()).add(link)
+
+    testbed._link_index = index
+    return index
+
+def _links(testbed, a_name, b_name):
+    '''
+    return a tuple of links between two devices, in either order
+
+    Lookups are served from the cached _link_index(), so any subsection can
+    call this repeatedly without walking the topology again.
+    '''
+    return tuple(_link_index(testbed).get(frozenset((a_name, b_name)), ()))
+
 #
 # Common Setup Section
 #
@@ -102,10 +150,8 @@ class common_setup(aetest.CommonSetup):
 
         # abort/fail the testscript if no matching device was provided
         for ios_name in (ios1_name, ios2_name):
-            if ios_name not in testbed:
-                self.failed('testbed needs to contain device {ios_name}'.format(
-                                        ios_name=ios_name,
-                                    ),
+            if ios_name not in testbed.devices:
+                self.failed(f'testbed needs to contain device {ios_name}',
                             goto = ['exit'])
 
         ios1 = testbed.devices[ios1_name]
@@ -115,11 +161,11 @@ class common_setup(aetest.CommonSetup):
         self.parent.parameters.update(ios1 = ios1, ios2 = ios2)
 
         # get corresponding links
-        links = ios1.find_links(ios2)
+        links = _links(testbed, ios1.name, ios2.name)
         assert len(links) >= 1, 'require one link between ios1 and ios2'
 
         # save link as uut link parameter
-        self.parent.parameters['uut_link'] = links.pop()
+        self.parent.parameters['uut_link'] = links[0]
 
 
     @aetest.subsection
@@ -128,11 +174,19 @@ class common_setup(aetest.CommonSetup):
         establish connection to both devices
         '''
 
-        with steps.start('Connecting to Router-1'):
-            ios1.connect()
+        routers = (('Router-1', ios1), ('Router-2', ios2))
+
+        # connect to all devices concurrently, then report each one as a step.
+        # each device keeps this single session open until common_cleanup, and
+        # every later execute()/ping() call is sent over it, so no testcase
+        # pays for another login.
+        with ThreadPoolExecutor(max_workers = len(routers)) as executor:
+            futures = [(name, executor.submit(device.connect))
+                       for name, device in routers]
 
-        with steps.start('Connecting to Router-2'):
-            ios2.connect()
+            for name, future in futures:
+                with steps.start(f'Connecting to {name}'):
+                    future.result()
 
         # abort/fail the testscript if any device isn't connected
         if not ios1.connected or not ios2.connected:
@@ -145,23 +199,24 @@ class common_setup(aetest.CommonSetup):
         mark the VerifyInterfaceCountTestcase for looping.
         '''
         # ignore VIRL lxc's
-        devices = [d for d in testbed.devices.keys() if 'mgmt' not in d]
+        devices = tuple(d for d in testbed.devices if 'mgmt' not in d)
 
-        logger.info(banner('Looping VerifyInterfaceCountTestcase'
-                           ' for {}'.format(devices)))
+        _info(lambda: f'Looping VerifyInterfaceCountTestcase for {devices}')
 
         # dynamic loop marking on testcase
         aetest.loop.mark(VerifyInterfaceCountTestcase, device = devices)
 
 
 #
-# Ping Testcase: leverage dual-level looping
+# Ping Testcase: ping from all devices concurrently
 #
-@aetest.loop(device = ('ios1', 'ios2'))
 class PingTestcase(aetest.Testcase):
     '''Ping test'''
 
-    groups = ('basic', 'looping')
+    groups = ('basic',)
+
+    # devices to ping from, by testscript parameter name
+    devices = ('ios1', 'ios2')
 
     @aetest.setup
     def setup(self, uut_link):
@@ -169,14 +224,44 @@ class PingTestcase(aetest.Testcase):
         for intf in uut_link.interfaces:
             destination.append(str(intf.ipv4.ip))
 
-        # apply loop to next section
-        aetest.loop.mark(self.ping, destination = destination)
+        # store destinations for the ping test
+        self.parameters['destination'] = destination
 
 
     @aetest.test
-    def ping(self, device, destination):
+    def ping(self, destination):
+        '''
+        ping destination ip addresses from all devices
+
+        Each device pings its destinations one after the other over its own
+        connection, while the devices themselves run concurrently. Every
+        ping is attempted, and all failures are reported together.
         '''
-        ping destination ip address from device
+
+        with ThreadPoolExecutor(max_workers = len(self.devices)) as executor:
+            futures = [(device, executor.submit(self._ping_device,
+                                                device, destination))
+                       for device in self.devices]
+
+            # collect every device's errors, even if another device's worker
+            # raised unexpectedly
+            errors = []
+            for device, future in futures:
+                try:
+                    errors.extend(future.result())
+                except Exception as e:
+                    errors.append(f'Ping from device {device} failed with '
+                                  f'error: {e}')
+
+        if errors:
+            # abort/fail the testscript if any ping command returned an
+            # exception such as connection timeout or command failure
+            self.failed('\n'.join(errors), goto = ['exit'])
+
+    def _ping_device(self, device, destination):
+        '''
+        ping each destination ip address in turn from device, returning a
+        list of error messages for the pings that failed
 
         Sample of ping command result:
 
@@ -195,30 +280,33 @@ class PingTestcase(aetest.Testcase):
 
         '''
 
-        try:
-            # store command result for later usage
-            result = self.parameters[device].ping(destination)
+        # look the device up once rather than on every destination
+        dev = self.parameters[device]
+        errors = []
+
+        for dest in destination:
+            try:
+                # store command result for later usage
+                result = dev.ping(dest)
+
+            except Exception as e:
+                # record which ping failed and carry on with the next one
+                errors.append(f'Ping {dest} from device {device} failed with '
+                              f'error: {e}')
+                continue
 
-        except Exception as e:
-            # abort/fail the testscript if ping command returns any exception
-            # such as connection timeout or command failure
-            self.failed('Ping {} from device {} failed with error: {}'.format(
-                                destination,
-                                device,
-                                str(e),
-                            ),
-                        goto = ['exit'])
-        else:
             # extract success rate from ping result with regular expression
-            match = re.search(r'Success rate is (?P<rate>\d+) percent', result)
-            success_rate = match.group('rate')
+            match = _PING_RE.search(result)
+            if not match:
+                errors.append(f'Ping {dest} from device {device} returned no '
+                              'success rate')
+                continue
+            success_rate = match[1]
             # log the success rate
-            logger.info(banner('Ping {} with success rate of {}%'.format(
-                                        destination,
-                                        success_rate,
-                                    )
-                               )
-                        )
+            _info(lambda: f'Ping {dest} from device {device} with success '
+                          f'rate of {success_rate}%')
+
+        return errors
 
 #
 # Verify Interface Count Testcase
@@ -228,8 +316,34 @@ class VerifyInterfaceCountTestcase(aetest.Testcase):
 
     groups = ('basic', 'looping')
 
+    @aetest.setup
+    def collect_outputs(self, device):
+        '''
+        execute `show version` and `show ip interface brief` in one call
+
+        Both outputs are stored as testcase parameters so that the tests below
+        can parse them without another round-trip to the device.
+        '''
+
+        try:
+            # a list of commands returns a dict of {command: output}
+            outputs = self.parameters[device].execute(['show version',
+                                                       'show ip interface brief'])
+
+        except Exception as e:
+            # abort/fail the testscript if either command returns any
+            # exception such as connection timeout or command failure
+            self.failed(f'Device {device} \'show version\' and \'show ip '
+                            f'interface brief\' failed: {e}',
+                        goto = ['exit'])
+        else:
+            # add them to testcase parameters
+            self.parameters.update(
+                show_version = outputs['show version'],
+                show_ip_interface_brief = outputs['show ip interface brief'])
+
     @aetest.test
-    def extract_interface_count(self, device):
+    def extract_interface_count(self, show_version):
         '''
         extract interface counts from `show version`
 
@@ -267,35 +381,23 @@ class VerifyInterfaceCountTestcase(aetest.Testcase):
 
         '''
 
-        try:
-            # store execution result for later usage
-            result = self.parameters[device].execute('show version')
-
-        except Exception as e:
-            # abort/fail the testscript if show version command returns any
-            # exception such as connection timeout or command failure
-            self.failed('Device {} \'show version\' failed: {}'.format(device,
-                                                                       str(e)),
-                        goto = ['exit'])
-        else:
-            # extract interfaces counts from `show version`
-            match = re.search(r'(?P<ethernet>\d+) Gigabit Ethernet interfaces\r\n', result)
-            ethernet_intf_count = int(match.group('ethernet'))
-            # log the interface counts
-            logger.info(banner('\'show version\' returns {} ethernet interfaces'
-                                            .format(
-                                            ethernet_intf_count
-
-                                        )
-                               )
-                        )
-            # add them to testcase parameters
-            self.parameters.update(ethernet_intf_count = ethernet_intf_count,
-                                   serial_intf_count = 0)
+        # extract interfaces counts from `show version`; the count is the
+        # whole line up to ' Gigabit Ethernet interfaces'
+        end = show_version.find(' Gigabit Ethernet interfaces\r\n')
+        if end == -1:
+            self.failed('\'show version\' has no ethernet interface count')
+        start = show_version.rfind('\n', 0, end) + 1
+        ethernet_intf_count = int(show_version[start:end])
+        # log the interface counts
+        _info(lambda: f'\'show version\' returns {ethernet_intf_count} '
+                      'ethernet interfaces')
+        # add them to testcase parameters
+        self.parameters.update(ethernet_intf_count = ethernet_intf_count,
+                               serial_intf_count = 0)
 
     @aetest.test
     def verify_interface_count(self,
-                               device,
+                               show_ip_interface_brief,
                                ethernet_intf_count = 0,
                                serial_intf_count = 0):
         '''
@@ -309,30 +411,22 @@ class VerifyInterfaceCountTestcase(aetest.Testcase):
         GigabitEthernet0/1         10.10.10.2      YES manual up                    up
         '''
 
-        try:
-            # store execution result for later usage
-            result = self.parameters[device].execute('show ip interface brief')
+        # count ethernet and serial interfaces in a single pass over the
+        # output; the pattern only matches physical interface names, so
+        # subinterfaces (GigabitEthernet0/1.100) and channels (Serial0/0:1)
+        # are skipped and the counts stay comparable with `show version`
+        intf_types = _INTF_RE.findall(show_ip_interface_brief)
+        len_ethernet_interfaces = intf_types.count('GigabitEthernet')
+        len_serial_interfaces = len(intf_types) - len_ethernet_interfaces
 
-        except Exception as e:
-            # abort/fail the testscript if show ip interface brief command
-            # returns any exception such as connection timeout or command
-            # failure
-            self.failed('Device {} \'show ip interface brief\' failed: '
-                            '{}'.format(device, str(e)),
-                        goto = ['exit'])
-        else:
-            # extract ethernet interfaces
-            ethernet_interfaces = re.finditer(r'\r\nGigabitEthernet\d+/\d+\s+', result)
-            # total number of ethernet interface
-            len_ethernet_interfaces = len(tuple(ethernet_interfaces))
-
-            # log the ethernet interface counts
-            logger.info(banner('\'show ip interface brief\' returns {} ethernet'
-                               ' interfaces'.format(len_ethernet_interfaces)))
+        # log the ethernet and serial interface counts
+        _info(lambda: f'\'show ip interface brief\' returns '
+                      f'{len_ethernet_interfaces} ethernet and '
+                      f'{len_serial_interfaces} serial interfaces')
 
-            # compare the ethernet interface count between
-            # `show ip interface brief` and `show version`
-            assert len_ethernet_interfaces == ethernet_intf_count
+        # compare the ethernet interface count between
+        # `show ip interface brief` and `show version`
+        assert len_ethernet_interfaces == ethernet_intf_count
 
 
 
@@ -343,11 +437,16 @@ class common_cleanup(aetest.CommonCleanup):
     def disconnect(self, steps, ios1, ios2):
         '''disconnect from both devices'''
 
-        with steps.start('Disconnecting from Router-1'):
-            ios1.disconnect()
+        routers = (('Router-1', ios1), ('Router-2', ios2))
+
+        # disconnect from all devices concurrently
+        with ThreadPoolExecutor(max_workers = len(routers)) as executor:
+            futures = [(name, executor.submit(device.disconnect))
+                       for name, device in routers]
 
-        with steps.start('Disconnecting from Router-2'):
-            ios2.disconnect()
+            for name, future in futures:
+                with steps.start(f'Disconnecting from {name}'):
+                    future.result()
 
         if ios1.connected or ios2.connected:
             # abort/fail the testscript if device connection still exists